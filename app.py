@@ -11,6 +11,7 @@ import os
 import traceback
 from typing import Annotated, Dict, List, Tuple
 import glob
+import httpx
 import openai
 import anthropic
 import groq
@@ -103,7 +104,7 @@ def get_assistant(app, mm: MultimodalRequest) -> Tuple[Assistant, str | None]:
     if mm.assistant == "gpt":
         assistant_model = validate_assistant_model(model=mm.assistant_model, models=[ "gpt-4o", "gpt-3.5-turbo-1106", "gpt-3.5-turbo", "gpt-4-turbo", "gpt-4-turbo-2024-04-09", "gpt-4-turbo-preview", "gpt-4-1106-preview" ])
         if mm.openai_key and len(mm.openai_key) > 0:
-            return GPTAssistant(client=openai.AsyncOpenAI(api_key=mm.openai_key)), assistant_model
+            return GPTAssistant(client=openai.AsyncOpenAI(api_key=mm.openai_key, http_client=app.state.http_client)), assistant_model
         return GPTAssistant(client=app.state.openai_client), assistant_model
     elif mm.assistant == "claude":
         assistant_model = validate_assistant_model(model=mm.assistant_model, models=[ "claude-3-sonnet-20240229", "claude-3-haiku-20240307", "claude-3-opus-20240229" ])
@@ -139,6 +140,13 @@ def get_vision_provider(app, mm: MultimodalRequest) -> Vision | None:
     # Default provider
     return app.state.vision
 
+@app.on_event("shutdown")
+async def close_http_client():
+    # Release the shared connection pool, if one was created
+    http_client = getattr(app.state, "http_client", None)
+    if http_client is not None:
+        await http_client.aclose()
+
 @app.get('/health')
 async def api_health():
     return {"status":200,"message":"running ok"}
@@ -176,7 +184,7 @@ async def api_mm(request: Request, mm: Annotated[str, Form()], audio : UploadFil
                 with open(filepath, "wb") as f:
                     f.write(audio_bytes)
             if mm.openai_key and len(mm.openai_key) > 0:
-                voice_prompt = await transcribe(client=openai.AsyncOpenAI(api_key=mm.openai_key), audio_bytes=audio_bytes)
+                voice_prompt = await transcribe(client=openai.AsyncOpenAI(api_key=mm.openai_key, http_client=request.app.state.http_client), audio_bytes=audio_bytes)
             else:
                 voice_prompt = await transcribe(client=request.app.state.openai_client, audio_bytes=audio_bytes)
 
@@ -238,7 +246,8 @@ async def api_mm(request: Request, mm: Annotated[str, Form()], audio : UploadFil
                 model=assistant_model,
                 web_search=web_search,
                 vision=vision,
-                speculative_vision=mm.speculative_vision
+                speculative_vision=mm.speculative_vision,
+                session_id=mm.session_id
             )
 
             return MultimodalResponse(
@@ -274,7 +283,6 @@ async def api_extract_learned_context(request: Request, params: Annotated[str, F
             learned_context = await extract_learned_context(
                 client=request.app.state.openai_client,
                 message_history=params.messages,
-                model="gpt-3.5-turbo-1106",
                 existing_learned_context=params.existing_learned_context,
                 token_usage_by_model=token_usage_by_model
             )
@@ -309,10 +317,17 @@ if __name__ == "__main__":
     parser.add_argument("--vision", action="store", help="Vision model to use (gpt-4o, gpt-4-vision-preview, claude-3-haiku-20240307, claude-3-sonnet-20240229, claude-3-opus-20240229)", default="gpt-4o")
     options = parser.parse_args()
 
+    # Shared HTTP connection pool for all AI clients, so that warm connections are reused
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+        timeout=httpx.Timeout(60.0, connect=10.0)
+    )
+
     # AI clients
-    app.state.openai_client = openai.AsyncOpenAI()
-    app.state.anthropic_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
-    app.state.groq_client = groq.AsyncGroq()
+    app.state.openai_client = openai.AsyncOpenAI(http_client=app.state.http_client)
+    app.state.anthropic_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, http_client=app.state.http_client)
+    app.state.groq_client = groq.AsyncGroq(http_client=app.state.http_client)
 
     # Instantiate a default web search provider
     app.state.web_search = None
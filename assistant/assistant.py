@@ -37,7 +37,8 @@ class Assistant(ABC):
         model: str | None,
         web_search: WebSearch,
         vision: Vision,
-        speculative_vision: bool
+        speculative_vision: bool,
+        session_id: str | None = None
     ) -> AssistantResponse:
         """
         Sends a message from user to assistant.
@@ -75,6 +76,10 @@ class Assistant(ABC):
             prompt as the query, but only use the result if the LLM then determines the vision tool
             should have been used. This reduces latency by the duration of the initial LLM call by
             giving the vision tool (which is usually slow) a head start.
+        session_id : str | None
+            Identifies the user's conversation across requests. If given, assistants that support
+            it will extract learned context in the background and apply it on the next request with
+            the same session ID.
 
         Returns
         -------
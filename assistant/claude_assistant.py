@@ -251,7 +251,7 @@ async def handle_photo_tool(
     location: str | None = None,
     learned_context: Dict[str,str] | None = None
 ) -> str | WebSearchResult:
-    extra_context = "\n\n" + create_context_system_message(local_time=local_time, location=location, learned_context=learned_context)
+    extra_context = create_context_system_message(local_time=local_time, location=location, learned_context=learned_context)
 
     # If no image bytes (glasses always send image but web playgrounds do not), return an error
     # message for the assistant to use
@@ -344,7 +344,8 @@ class ClaudeAssistant(Assistant):
         model: str | None,
         web_search: WebSearch,
         vision: Vision,
-        speculative_vision: bool
+        speculative_vision: bool,
+        session_id: str | None = None
     ) -> AssistantResponse:
         model = model if model is not None else "claude-3-sonnet-20240229"
 
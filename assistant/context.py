@@ -9,10 +9,11 @@
 # contextually-aware, and personalized responses.
 #
 
-from typing import Dict, List
+from functools import lru_cache
+from typing import Dict, List, Tuple
 
 import openai
-import groq
+import orjson
 
 from models import Role, Message, TokenUsage, accumulate_token_usage
 
@@ -21,6 +22,10 @@ from models import Role, Message, TokenUsage, accumulate_token_usage
 # Prompts
 ####################################################################################################
 
+# Extraction is an easy task that does not warrant the main assistant model, so we always use a small,
+# fast model
+LEARNED_CONTEXT_EXTRACTION_MODEL = "gpt-4o-mini"
+
 # These are context keys we try to detect in conversation history over time
 LEARNED_CONTEXT_KEY_DESCRIPTIONS = {
     "UserName": "User's name",
@@ -33,13 +38,13 @@ Given a transcript of what the user said, look for any of the following informat
 
 """ + "\n".join([ key + ": "  + description for key, description in LEARNED_CONTEXT_KEY_DESCRIPTIONS.items() ]) + """
 
-Make sure to list them in this format:
-
-KEY=VALUE
-
-If nothing was found, just say "END". ONLY PRODUCE ITEMS WHEN THE USER HAS ACTUALLY REVEALED THEM.
+Return a JSON object whose keys are the names above and whose values are strings. Omit any key that
+was not revealed. If nothing was found, return an empty object. ONLY PRODUCE ITEMS WHEN THE USER HAS
+ACTUALLY REVEALED THEM.
 """
 
+LEARNED_CONTEXT_EXTRACTION_MESSAGE = Message(role=Role.SYSTEM, content=LEARNED_CONTEXT_EXTRACTION_SYSTEM_MESSAGE)
+
 CONTEXT_SYSTEM_MESSAGE_PREFIX = "## Additional context about the user:"
 
 
@@ -69,6 +74,16 @@ def create_context_system_message(local_time: str | None, location: str | None,
         Message to combine with existing system message or to inject as a new, extra system
         message.
     """
+    # Context strings are rebuilt for every request and every photo tool call, usually with the
+    # same inputs, so the result is cached. Dicts are unhashable and must be converted to tuples.
+    return _create_context_system_message(
+        local_time=local_time,
+        location=location,
+        learned_context=tuple(learned_context.items()) if learned_context is not None else None
+    )
+
+@lru_cache(maxsize=256)
+def _create_context_system_message(local_time: str | None, location: str | None, learned_context: Tuple[Tuple[str, str], ...] | None) -> str:
     # Fixed context: things we know and need not extract from user conversation history
     context: Dict[str, str] = {}
     if local_time is not None and len(local_time) > 0:
@@ -89,9 +104,8 @@ def create_context_system_message(local_time: str | None, location: str | None,
     return system_message_fragment
 
 async def extract_learned_context(
-    client: openai.AsyncOpenAI | groq.AsyncGroq,
+    client: openai.AsyncOpenAI,
     message_history: List[Message],
-    model: str,
     existing_learned_context: Dict[str, str],
     token_usage_by_model: Dict[str, TokenUsage]
 ) -> Dict[str, str]:
@@ -105,22 +119,24 @@ async def extract_learned_context(
             messages.append(message_history[i])
 
     # Insert system message and reverse so that it is in the right order
-    messages.append(Message(role=Role.SYSTEM, content=LEARNED_CONTEXT_EXTRACTION_SYSTEM_MESSAGE))
+    messages.append(LEARNED_CONTEXT_EXTRACTION_MESSAGE)
     messages.reverse()
 
     # print("Context extraction input:")
     # print(messages)
 
     # Process
+    extraction_model = LEARNED_CONTEXT_EXTRACTION_MODEL
     response = await client.chat.completions.create(
-        model=model,
-        messages=messages
+        model=extraction_model,
+        messages=messages,
+        response_format={ "type": "json_object" }
     )
 
     # Do not forget to count tokens used!
     accumulate_token_usage(
         token_usage_by_model=token_usage_by_model,
-        model=model,
+        model=extraction_model,
         input_tokens=response.usage.prompt_tokens,
         output_tokens=response.usage.completion_tokens,
         total_tokens=response.usage.total_tokens
@@ -132,12 +148,19 @@ async def extract_learned_context(
 
     # Parse it into a dictionary
     learned_context: Dict[str,str] = {}
-    lines = response.choices[0].message.content.splitlines()
-    for line in lines:
-        parts = line.split("=")
-        if len(parts) == 2:
-            key, value = parts
-            if key in LEARNED_CONTEXT_KEY_DESCRIPTIONS:
+    try:
+        extracted = orjson.loads(response.choices[0].message.content)
+    except orjson.JSONDecodeError:
+        extracted = {}
+    if isinstance(extracted, dict):
+        # JSON mode may produce lists (e.g. of foods), which are joined as in debug output. Anything
+        # else that is not a string is dropped.
+        for key, value in extracted.items():
+            if key not in LEARNED_CONTEXT_KEY_DESCRIPTIONS:
+                continue
+            if isinstance(value, list):
+                value = ", ".join([ str(item) for item in value if item is not None ])
+            if isinstance(value, str) and len(value) > 0:
                 learned_context[key] = value
     
     # Merge with existing
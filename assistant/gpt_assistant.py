@@ -11,31 +11,42 @@
 # TODO:
 # -----
 # - Speculative vision tool should create a proper tools_used entry.
-# - Move to streaming completions and detect timeouts when a threshold duration elapses since the
-#   the last token was emitted.
 # - Figure out how to get assistant to stop referring to "photo" and "image" when analyzing photos.
 # - Improve people search.
 #
 
 import asyncio
 import base64
-import json
+from collections import deque, OrderedDict
+import heapq
+from operator import itemgetter
+import time
 import timeit
-from typing import Any, Dict, List
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Set, Tuple
 
 import openai
-from openai.types.chat import ChatCompletionMessageToolCall
+import orjson
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
 import groq
 # from groq.types.chat.chat_completion_message_tool_call import ChatCompletionMessageToolCall
 
 from .assistant import Assistant, AssistantResponse
-from .context import create_context_system_message
+from .context import create_context_system_message, extract_learned_context
 from web_search import WebSearch, WebSearchResult
-from vision import Vision, GPT4Vision
+from vision import Vision, VisionOutput, GPT4Vision
 from vision.utils import detect_media_type
-from models import Role, Message, Capability, TokenUsage, accumulate_token_usage
+from models import Role, Message, Capability, TokenUsage
 from generate_image.replicate import ReplicateGenerateImage
 
+####################################################################################################
+# Configuration
+####################################################################################################
+
+# Maximum time to wait for the next chunk of a streaming completion before giving up on the stream
+STREAM_IDLE_TIMEOUT_SECONDS = 10.0
+
+
 ####################################################################################################
 # Prompts
 ####################################################################################################
@@ -57,6 +68,27 @@ Make your responses precise. Respond without any preamble when giving translatio
 directly.
 """
 
+SYSTEM_MESSAGE_OBJECT = Message(role=Role.SYSTEM, content=SYSTEM_MESSAGE)
+
+
+#
+# Canned responses to prompts we can answer without the model
+#
+
+EMPTY_PROMPT_RESPONSE = "I didn't catch that. Could you repeat?"
+NO_PHOTO_RESPONSE = "I think you're referring to something you can see. Can you provide a photo?"
+
+# Prompts that can only refer to something the user sees, normalized to lowercase without trailing
+# punctuation
+DEMONSTRATIVE_ONLY_PROMPTS = frozenset([
+    "what's that",
+    "what is that",
+    "what's this",
+    "what is this",
+    "what am i looking at",
+    "what do you see"
+])
+
 
 ####################################################################################################
 # Tools
@@ -142,8 +174,21 @@ Use this tool if user refers to something not identifiable from conversation con
     
 ]
 
+# Parameter descriptions of each tool, by tool name
+_PARAMS_BY_TOOL: Dict[str, Dict[str, Any]] = { tool["function"]["name"]: tool["function"]["parameters"]["properties"] for tool in TOOLS }
+
+# Python types of the tool parameter types we support. Need to keep this up to date with the tools
+# we define.
+_TYPE_CHECKERS: Dict[str, type] = { "string": str, "boolean": bool }
+
+# Expected Python type of each parameter, by tool name. Fails at import if a tool uses an
+# unsupported parameter type.
+_TOOL_VALIDATORS: Dict[str, Dict[str, type]] = {
+    tool_name: { param_name: _TYPE_CHECKERS[param_spec["type"]] for param_name, param_spec in params.items() }
+    for tool_name, params in _PARAMS_BY_TOOL.items()
+}
+
 async def handle_tool(
-    tools: List[Any],
     tool_call: ChatCompletionMessageToolCall,
     user_message: str,
     message_history: List[Message] | None,
@@ -158,21 +203,13 @@ async def handle_tool(
     tools_used: List[Dict[str, Any]],
     timings: Dict[str, str]
 ) -> str:
-    tool_functions = {
-        SEARCH_TOOL_NAME: web_search.search_web,                # returns WebSearchResult
-        PHOTO_TOOL_NAME: handle_photo_tool,                     # returns WebSearchResult | str
-        DUMMY_SEARCH_TOOL_NAME: handle_general_knowledge_tool,  # returns str
-        IMAGE_GENERATION_TOOL_NAME: handle_image_generation_tool # returns str
-    }
-
     function_name = tool_call.function.name
-    function_to_call = tool_functions.get(function_name)
-    if function_to_call is None:
+    if function_name not in _TOOL_ROUTES:
         # Error: GPT hallucinated a tool
         return "Error: you hallucinated a tool that doesn't exist. Tell user you had trouble interpreting the request and ask them to rephrase it."
+    function_to_call = _TOOL_ROUTES[function_name] or web_search.search_web
 
     function_args = prepare_tool_arguments(
-        tools=tools,
         tool_call=tool_call,
         user_message=user_message,
         message_history=message_history,
@@ -215,7 +252,6 @@ async def handle_tool(
     return tool_output
 
 def prepare_tool_arguments(
-    tools: List[Any],
     tool_call: ChatCompletionMessageToolCall,
     user_message: str,
     message_history: List[Message] | None,
@@ -228,31 +264,7 @@ def prepare_tool_arguments(
     token_usage_by_model: Dict[str, TokenUsage],
     capabilities_used: List[Capability]
 ) -> Dict[str, Any]:
-    # Get function description we passed to GPT. This function should be called after we have
-    # validated that a valid tool call was generated.
-    function_description = [ description for description in tools if description["function"]["name"] == tool_call.function.name ][0]
-    function_parameters = function_description["function"]["parameters"]["properties"]
-
-    # Parse arguments and ensure they are all str or bool for now. Drop any that aren't.
-    args: Dict[str, Any] = {}
-    try:
-        args = json.loads(tool_call.function.arguments)
-    except:
-        pass
-    for param_name in list(args.keys()):
-        if param_name not in function_parameters:
-            # GPT hallucinated a parameter
-            del args[param_name]
-            continue
-        if function_parameters[param_name]["type"] == "string" and type(args[param_name]) != str:
-            del args[param_name]
-            continue
-        if function_parameters[param_name]["type"] == "boolean" and type(args[param_name]) != bool:
-            del args[param_name]
-            continue
-        if function_parameters[param_name]["type"] not in [ "string", "boolean" ]:
-            # Need to keep this up to date with the tools we define
-            raise ValueError(f"Unsupported tool parameter type: {function_parameters[param_name]['type']}")
+    args = parse_tool_arguments(tool_call=tool_call)
 
     # Fill in args required by all tools
     args["location"] = location if location else "unknown"
@@ -273,6 +285,21 @@ def prepare_tool_arguments(
 
     return args
 
+def parse_tool_arguments(tool_call: ChatCompletionMessageToolCall) -> Dict[str, Any]:
+    # Get expected parameter types of function we described to GPT. This function should be called
+    # after we have validated that a valid tool call was generated.
+    validators = _TOOL_VALIDATORS[tool_call.function.name]
+
+    # Parse arguments and ensure they are all of the expected type. Drop any that aren't, as well as
+    # any parameters GPT hallucinated.
+    args: Dict[str, Any] = {}
+    try:
+        args = orjson.loads(tool_call.function.arguments)
+    except:
+        pass
+    args = { param_name: value for param_name, value in args.items() if (expected_type := validators.get(param_name)) is not None and isinstance(value, expected_type) }
+    return args
+
 async def handle_general_knowledge_tool(
     query: str,
     message_history: List[Message] | None,
@@ -308,14 +335,14 @@ async def handle_photo_tool(
     location: str | None = None,
     learned_context: Dict[str,str] | None = None
 ) -> str | WebSearchResult:
-    extra_context = "\n\n" + create_context_system_message(local_time=local_time, location=location, learned_context=learned_context)
+    extra_context = create_context_system_message(local_time=local_time, location=location, learned_context=learned_context)
 
     # If no image bytes (glasses always send image but web playgrounds do not), return an error
     # message for the assistant to use
     if image_bytes is None or len(image_bytes) == 0:
         # Because this is a tool response, using "tell user" seems to ensure that the final
         # assistant response is what we want
-        return "Error: no photo supplied. Tell user: I think you're referring to something you can see. Can you provide a photo?"
+        return f"Error: no photo supplied. Tell user: {NO_PHOTO_RESPONSE}"
 
     # Vision tool
     capabilities_used.append(Capability.VISION)
@@ -326,6 +353,92 @@ async def handle_photo_tool(
         token_usage_by_model=token_usage_by_model
     )
     print(f"Vision: {output}")
+    return await complete_photo_tool(
+        output=output,
+        message_history=message_history,
+        web_search=web_search,
+        token_usage_by_model=token_usage_by_model,
+        capabilities_used=capabilities_used,
+        image_bytes=image_bytes,
+        location=location
+    )
+
+async def handle_photo_tool_batch(
+    tool_calls: List[ChatCompletionMessageToolCall],
+    user_message: str,
+    message_history: List[Message] | None,
+    image_bytes: bytes | None,
+    location: str | None,
+    local_time: str | None,
+    web_search: WebSearch,
+    vision: Vision,
+    learned_context: Dict[str, str] | None,
+    token_usage_by_model: Dict[str, TokenUsage],
+    capabilities_used: List[Capability],
+    tools_used: List[Dict[str, Any]],
+    timings: Dict[str, str]
+) -> List[str]:
+    """
+    Handles multiple photo tool calls with a single batched vision query, so that the image is only
+    uploaded once. Returns the tool output for each tool call, in order.
+    """
+    queries = [ parse_tool_arguments(tool_call=tool_call).get(QUERY_PARAM_NAME, user_message) for tool_call in tool_calls ]
+
+    # If no image bytes (glasses always send image but web playgrounds do not), return an error
+    # message for the assistant to use
+    if image_bytes is None or len(image_bytes) == 0:
+        return [ f"Error: no photo supplied. Tell user: {NO_PHOTO_RESPONSE}" ] * len(tool_calls)
+
+    # Vision tool
+    tool_start_time = timeit.default_timer()
+    extra_context = create_context_system_message(local_time=local_time, location=location, learned_context=learned_context)
+    capabilities_used.append(Capability.VISION)
+    outputs = await vision.query_image_batch(
+        queries=queries,
+        extra_context=extra_context,
+        image_bytes=image_bytes,
+        token_usage_by_model=token_usage_by_model
+    )
+    print(f"Vision: {outputs}")
+    tool_outputs = await asyncio.gather(*[
+        complete_photo_tool(
+            output=output,
+            message_history=message_history,
+            web_search=web_search,
+            token_usage_by_model=token_usage_by_model,
+            capabilities_used=capabilities_used,
+            image_bytes=image_bytes,
+            location=location
+        )
+        for output in outputs
+    ])
+    total_tool_time = round(timeit.default_timer() - tool_start_time, 3)
+    timings[f"tool_{PHOTO_TOOL_NAME}"] = f"{total_tool_time:.3f}"
+
+    for query in queries:
+        tools_used.append(
+            create_debug_tool_info_object(
+                function_name=PHOTO_TOOL_NAME,
+                function_args={ QUERY_PARAM_NAME: query, "batch_size": len(queries) },
+                tool_time=total_tool_time
+            )
+        )
+
+    return [ tool_output.summary if isinstance(tool_output, WebSearchResult) else tool_output for tool_output in tool_outputs ]
+
+async def complete_photo_tool(
+    output: VisionOutput | None,
+    message_history: List[Message] | None,
+    web_search: WebSearch,
+    token_usage_by_model: Dict[str, TokenUsage],
+    capabilities_used: List[Capability],
+    image_bytes: bytes | None,
+    location: str | None
+) -> str | WebSearchResult:
+    """
+    Produces the photo tool response from the vision tool output, performing a follow-up web search
+    if the vision tool requested one.
+    """
     if output is None:
         return "Error: vision tool generated an improperly formatted result. Tell user that there was a temporary glitch and ask them to try again."
     
@@ -366,30 +479,32 @@ async def handle_image_generation_tool(
     image = await image_generator.generate_image(query=description, use_image=True, image_bytes=image_bytes)
     return image
 
+# Handler for each tool. Web search is performed by the per-request WebSearch provider and is
+# therefore None here, to be bound at call time.
+_TOOL_ROUTES: Dict[str, Callable[..., Awaitable[WebSearchResult | str]] | None] = {
+    SEARCH_TOOL_NAME: None,                                     # returns WebSearchResult
+    PHOTO_TOOL_NAME: handle_photo_tool,                         # returns WebSearchResult | str
+    DUMMY_SEARCH_TOOL_NAME: handle_general_knowledge_tool,      # returns str
+    IMAGE_GENERATION_TOOL_NAME: handle_image_generation_tool    # returns str
+}
+
+# Tool arguments omitted from debug output
+_DEBUG_EXCLUDED_TOOL_ARGS = frozenset([ "vision", "web_search", "token_usage_by_model", "prompt" ])
+
 def create_debug_tool_info_object(function_name: str, function_args: Dict[str, Any], tool_time: float, search_result: str | None = None) -> Dict[str, Any]:
     """
     Produces an object of arbitrary keys and values intended to serve as a debug description of tool
     use.
     """
-    function_args = function_args.copy()
-
-    # Sanitize bytes, which are often too long to print
-    for arg_name, value in function_args.items():
-        if isinstance(value, bytes):
-            function_args[arg_name] = "<bytes>"
-        if isinstance(value, list) and arg_name != "message_history":
-            function_args[arg_name] = ", ".join(function_args[arg_name])
-    if "vision" in function_args:
-        del function_args["vision"]
-    if "web_search" in function_args:
-        del function_args["web_search"]
-    if "token_usage_by_model" in function_args:
-        del function_args["token_usage_by_model"]
-    if "prompt" in function_args:
-        del function_args["prompt"]
+    # Drop excluded args and sanitize bytes, which are often too long to print
+    sanitized_args = {
+        arg_name: "<bytes>" if isinstance(value, bytes) else ", ".join(value) if isinstance(value, list) and arg_name != "message_history" else value
+        for arg_name, value in function_args.items()
+        if arg_name not in _DEBUG_EXCLUDED_TOOL_ARGS
+    }
     to_return = {
         "tool": function_name,
-        "tool_args": function_args,
+        "tool_args": sanitized_args,
         "tool_time": tool_time
     }
     if search_result:
@@ -397,6 +512,38 @@ def create_debug_tool_info_object(function_name: str, function_args: Dict[str, A
     return to_return
 
 
+####################################################################################################
+# Learned Context Extraction
+####################################################################################################
+
+# In-flight learned context extractions, by session ID, each consumed by the following request in
+# the same session. Kept at module level because assistant instances may be created per request.
+# Bounded in size and age so that sessions that never return do not accumulate.
+MAX_LEARNED_CONTEXT_TASKS = 1000
+LEARNED_CONTEXT_TASK_TTL_SECONDS = 30 * 60
+_learned_context_tasks: OrderedDict[str, Tuple[float, asyncio.Task]] = OrderedDict()
+
+def _store_learned_context_task(session_id: str, task: asyncio.Task):
+    _learned_context_tasks.pop(session_id, None)
+    _learned_context_tasks[session_id] = (time.monotonic(), task)
+    _evict_learned_context_tasks()
+
+def _pop_learned_context_task(session_id: str) -> asyncio.Task | None:
+    _evict_learned_context_tasks()
+    entry = _learned_context_tasks.pop(session_id, None)
+    return entry[1] if entry is not None else None
+
+def _evict_learned_context_tasks():
+    # Entries are in insertion order, so the oldest are always at the front
+    expiry_time = time.monotonic() - LEARNED_CONTEXT_TASK_TTL_SECONDS
+    while len(_learned_context_tasks) > 0:
+        created_time, task = next(iter(_learned_context_tasks.values()))
+        if len(_learned_context_tasks) <= MAX_LEARNED_CONTEXT_TASKS and created_time >= expiry_time:
+            break
+        _learned_context_tasks.popitem(last=False)
+        task.cancel()
+
+
 ####################################################################################################
 # Assistant Class
 ####################################################################################################
@@ -422,8 +569,16 @@ class GPTAssistant(Assistant):
         model: str | None,
         web_search: WebSearch,
         vision: Vision,
-        speculative_vision: bool
+        speculative_vision: bool,
+        session_id: str | None = None
     ) -> AssistantResponse:
+        # Trivial prompts that cannot be answered are responded to immediately, without a round
+        # trip to the model
+        if image_bytes is None and (not prompt or prompt.isspace()):
+            return self._canned_response(response=EMPTY_PROMPT_RESPONSE)
+        if image_bytes is None and not message_history and prompt.strip(" ?!.").lower() in DEMONSTRATIVE_ONLY_PROMPTS:
+            return self._canned_response(response=NO_PHOTO_RESPONSE)
+
         # Default model (differs for OpenAI and Groq)
         if model is None:
             if type(self._client) == openai.AsyncOpenAI:
@@ -459,18 +614,23 @@ class GPTAssistant(Assistant):
         message_history = message_history.copy() if message_history else None
         full_message_history = message_history.copy() if message_history else None
 
+        # Learned context is extracted in the background and merged in on the session's next turn,
+        # keeping extraction off the critical path. Context supplied by the caller takes precedence.
+        extract_context = session_id is not None and isinstance(self._client, openai.AsyncOpenAI)
+        previous_learned_context_task = None
+        if extract_context:
+            previously_learned_context, previous_learned_context_task = await self._consume_learned_context_task(session_id=session_id, token_usage_by_model=returned_response.token_usage_by_model)
+            learned_context = { **previously_learned_context, **(learned_context if learned_context is not None else {}) }
+
         # Add user message to message history or create a new one if necessary
         user_message = Message(role=Role.USER, content=prompt)
-        system_message = Message(role=Role.SYSTEM, content=SYSTEM_MESSAGE)
+        system_message = SYSTEM_MESSAGE_OBJECT
         if not message_history:
-            message_history = []
-        if len(message_history) == 0:
             message_history = [ system_message ]
-        else:
+        elif message_history[0].role != Role.SYSTEM:
             # Insert system message before message history, unless client transmitted one they want
             # to use
-            if len(message_history) > 0 and message_history[0].role != Role.SYSTEM:
-                message_history.insert(0, system_message)
+            message_history.insert(0, system_message)
         message_history.append(user_message)
         message_history = self._prune_history(message_history=message_history)
 
@@ -528,13 +688,108 @@ class GPTAssistant(Assistant):
             )
         ) 
 
+        # Tools are dispatched as soon as their arguments have been fully streamed, overlapping tool
+        # latency with the remainder of the initial completion. Vision and web search are special:
+        # we already have speculative queries in progress.
+        tools_used = []
+        tools_used.append({ "learned_context": learned_context })   # log context here for now
+        tool_tasks: Dict[int, asyncio.Future] = {}
+        dispatched_tool_calls: Dict[int, ChatCompletionMessageToolCall] = {}
+
+        # Capabilities and debug info are recorded separately for each dispatched tool call and only
+        # merged into the response once the call is known to be part of the final tool calls
+        capabilities_used_by_tool: Dict[int, List[Capability]] = {}
+        tools_used_by_tool: Dict[int, List[Dict[str, Any]]] = {}
+
+        def dispatch_tool(index: int, tool_call: ChatCompletionMessageToolCall):
+            dispatched_tool_calls[index] = tool_call
+            capabilities_used = capabilities_used_by_tool[index] = []
+            tool_debug_info = tools_used_by_tool[index] = []
+            if tool_call.function.name == PHOTO_TOOL_NAME and speculative_vision_task is not None:
+                tool_tasks[index] = speculative_vision_task
+                tool_debug_info.append(
+                    create_debug_tool_info_object(
+                        function_name=PHOTO_TOOL_NAME,
+                        function_args={},
+                        tool_time=-1,
+                        search_result=None
+                    )
+                )
+            elif tool_call.function.name == SEARCH_TOOL_NAME and speculative_search_task is not None:
+                tool_tasks[index] = speculative_search_task
+                capabilities_used.append(Capability.WEB_SEARCH)
+                tool_debug_info.append(
+                    create_debug_tool_info_object(
+                        function_name=SEARCH_TOOL_NAME,
+                        function_args={},
+                        tool_time=-1,
+                        search_result=None
+                    )
+                )
+            else:
+                tool_tasks[index] = asyncio.create_task(
+                    handle_tool(
+                        tool_call=tool_call,
+                        user_message=prompt,
+                        message_history=full_message_history,   # full history because tools may have their own requirements on history length
+                        image_bytes=image_bytes,
+                        location=location_address,
+                        local_time=local_time,
+                        web_search=web_search,
+                        vision=vision,
+                        learned_context=learned_context,
+                        token_usage_by_model=returned_response.token_usage_by_model,
+                        capabilities_used=capabilities_used,
+                        tools_used=tool_debug_info,
+                        timings=timings
+                    )
+                )
+
+        def dispatch_tool_early(index: int, tool_call: ChatCompletionMessageToolCall):
+            # General knowledge tool is a no-op that may be answered by the speculative direct
+            # answer, so defer it until we see all the tool calls. Without a speculative vision
+            # query, photo tool calls are deferred as well so that they can all be batched into a
+            # single vision request.
+            if tool_call.function.name == DUMMY_SEARCH_TOOL_NAME:
+                return
+            if tool_call.function.name == PHOTO_TOOL_NAME and speculative_vision_task is None:
+                return
+            dispatch_tool(index=index, tool_call=tool_call)
+
+        # Kick off extraction of learned context for the next turn
+        if extract_context:
+            _store_learned_context_task(
+                session_id=session_id,
+                task=asyncio.create_task(
+                    self._extract_learned_context(
+                        message_history=(full_message_history if full_message_history else []) + [ Message(role=Role.USER, content=prompt) ],
+                        learned_context=learned_context,
+                        previous_task=previous_learned_context_task
+                    )
+                )
+            )
+
         # Initial GPT call, which may request tool use
         initial_llm_task = asyncio.create_task(
-            self._client.chat.completions.create(
+            self._stream_completion(
                 model=model,
                 messages=message_history,
+                token_usage_by_model=returned_response.token_usage_by_model,
                 tools=tools,
-                tool_choice="auto"
+                on_tool_call=dispatch_tool_early
+            )
+        )
+
+        # Speculative direct answer without tools, run in parallel with the initial call. If GPT
+        # only reaches for the general knowledge tool, this is the answer it would have produced
+        # after the tool round trip, so we can skip the second call entirely. Note that when this
+        # task is cancelled, tokens it already consumed are billed but not counted in
+        # token_usage_by_model, because usage is only reported at the end of the stream.
+        direct_llm_task = asyncio.create_task(
+            self._stream_completion(
+                model=model,
+                messages=message_history.copy(),
+                token_usage_by_model=returned_response.token_usage_by_model
             )
         )
 
@@ -545,81 +800,98 @@ class GPTAssistant(Assistant):
         if speculative_search_task is not None:
             initial_tasks.append(speculative_search_task)
         completed_tasks, pending_tasks = await asyncio.wait(initial_tasks, return_when=asyncio.FIRST_COMPLETED)
-        first_response = await initial_llm_task
-        first_response_message = first_response.choices[0].message
+        first_response_message = await initial_llm_task
         t1 = timeit.default_timer()
         timings["llm_initial"] = f"{t1-t0:.3f}"
 
-        # Aggregate token counts and potential initial response
-        accumulate_token_usage(
-            token_usage_by_model=returned_response.token_usage_by_model,
-            model=model,
-            input_tokens=first_response.usage.prompt_tokens,
-            output_tokens=first_response.usage.completion_tokens,
-            total_tokens=first_response.usage.total_tokens
-        )
+        # If the stream timed out, the initial response comes from a non-streaming retry whose tool
+        # calls may differ from the ones already dispatched. Discard any that no longer match, along
+        # with the capabilities and debug info they recorded.
+        final_tool_calls = first_response_message.tool_calls or []
+        for index in list(tool_tasks.keys()):
+            dispatched_tool_call = dispatched_tool_calls[index]
+            if index < len(final_tool_calls) and final_tool_calls[index].function.name == dispatched_tool_call.function.name and final_tool_calls[index].function.arguments == dispatched_tool_call.function.arguments:
+                continue
+            task = tool_tasks.pop(index)
+            capabilities_used_by_tool.pop(index)
+            tools_used_by_tool.pop(index)
+            if task is not speculative_vision_task and task is not speculative_search_task:
+                task.cancel()
+
+        # If image generation tool then kill speculative tasks
+        if len(final_tool_calls) > 0 and final_tool_calls[0].function.name == IMAGE_GENERATION_TOOL_NAME:
+            self._cancel_tasks([ speculative_vision_task, speculative_search_task ])
 
         # If there are no tool requests, the initial response will be returned
         returned_response.response = first_response_message.content
 
+        # General knowledge only: use the speculative direct answer instead of a second call. If it
+        # failed, fall back to the regular tool round trip.
+        direct_response_message = None
+        if first_response_message.tool_calls and all([ tool_call.function.name == DUMMY_SEARCH_TOOL_NAME for tool_call in first_response_message.tool_calls ]):
+            self._cancel_tasks([ speculative_vision_task, speculative_search_task ])
+            t0 = timeit.default_timer()
+            try:
+                direct_response_message = await direct_llm_task
+            except Exception as e:
+                print(f"Speculative direct answer failed, falling back to tool use: {e}")
+            t1 = timeit.default_timer()
+            timings["llm_direct_wait"] = f"{t1-t0:.3f}"
+
         # Handle tool requests
-        tools_used = []
-        tools_used.append({ "learned_context": learned_context })   # log context here for now
-        if first_response_message.tool_calls:
-            # If image generation tool then kill speculative tasks
-            if first_response_message.tool_calls[0].function.name == IMAGE_GENERATION_TOOL_NAME:
-                self._cancel_tasks([ speculative_vision_task, speculative_search_task ])
+        if direct_response_message is not None:
+            returned_response.capabilities_used.append(Capability.ASSISTANT_KNOWLEDGE)
+            tools_used.append(
+                create_debug_tool_info_object(
+                    function_name=DUMMY_SEARCH_TOOL_NAME,
+                    function_args={},
+                    tool_time=0,
+                    search_result=None
+                )
+            )
+            returned_response.response = direct_response_message.content
+        elif first_response_message.tool_calls:
+            # Speculative direct answer will not be used
+            self._cancel_tasks([ direct_llm_task ])
+
             # Append initial response to history, which may include tool use
             message_history.append(first_response_message)
 
-            # Invoke all the tools in parallel and wait for them all to complete. Vision is special:
-            # we already have a speculative query in progress.
+            # Dispatch any remaining tools and wait for them all to complete. Most will already be
+            # done or in progress.
             t0 = timeit.default_timer()
-            tool_handlers = []
-            for tool_call in first_response_message.tool_calls:
-                if tool_call.function.name == PHOTO_TOOL_NAME and speculative_vision_task is not None:
-                    tool_handlers.append(speculative_vision_task)
-                    tools_used.append(
-                        create_debug_tool_info_object(
-                            function_name=PHOTO_TOOL_NAME,
-                            function_args={},
-                            tool_time=-1,
-                            search_result=None
-                        )
-                    )
-                elif tool_call.function.name == SEARCH_TOOL_NAME and speculative_search_task is not None:
-                    tool_handlers.append(speculative_search_task)
-                    returned_response.capabilities_used.append(Capability.WEB_SEARCH)
-                    tools_used.append(
-                        create_debug_tool_info_object(
-                            function_name=SEARCH_TOOL_NAME,
-                            function_args={},
-                            tool_time=-1,
-                            search_result=None
-                        )
-                    )
-                else:
-                    tool_handlers.append(
-                        handle_tool(
-                            tools=tools,
-                            tool_call=tool_call,
-                            user_message=prompt,
-                            message_history=full_message_history,   # full history because tools may have their own requirements on history length
-                            image_bytes=image_bytes,
-                            location=location_address,
-                            local_time=local_time,
-                            web_search=web_search,
-                            vision=vision,
-                            learned_context=learned_context,
-                            token_usage_by_model=returned_response.token_usage_by_model,
-                            capabilities_used=returned_response.capabilities_used,
-                            tools_used=tools_used,
-                            timings=timings
-                        )
+            photo_tool_indices = [ index for index, tool_call in enumerate(first_response_message.tool_calls) if index not in tool_tasks and tool_call.function.name == PHOTO_TOOL_NAME ]
+            if len(photo_tool_indices) > 1:
+                # Queries about the same image are submitted as a single vision request
+                photo_batch_task = asyncio.create_task(
+                    handle_photo_tool_batch(
+                        tool_calls=[ first_response_message.tool_calls[index] for index in photo_tool_indices ],
+                        user_message=prompt,
+                        message_history=full_message_history,
+                        image_bytes=image_bytes,
+                        location=location_address,
+                        local_time=local_time,
+                        web_search=web_search,
+                        vision=vision,
+                        learned_context=learned_context,
+                        token_usage_by_model=returned_response.token_usage_by_model,
+                        capabilities_used=returned_response.capabilities_used,
+                        tools_used=tools_used,
+                        timings=timings
                     )
+                )
+                for position, index in enumerate(photo_tool_indices):
+                    tool_tasks[index] = asyncio.create_task(self._get_batch_result(batch_task=photo_batch_task, position=position))
+            for index, tool_call in enumerate(first_response_message.tool_calls):
+                if index not in tool_tasks:
+                    dispatch_tool(index=index, tool_call=tool_call)
+            tool_handlers = [ tool_tasks[index] for index in range(len(first_response_message.tool_calls)) ]
             tool_outputs = await asyncio.gather(*tool_handlers)
             t1 = timeit.default_timer()
             timings["tool_calls"] = f"{t1-t0:.3f}"
+            for index in range(len(first_response_message.tool_calls)):
+                returned_response.capabilities_used.extend(capabilities_used_by_tool.get(index, []))
+                tools_used.extend(tools_used_by_tool.get(index, []))
 
             # Ensure everything is str
             for i in range(len(tool_outputs)):
@@ -631,12 +903,12 @@ class GPTAssistant(Assistant):
                 # If image generation tool then return response
                 if first_response_message.tool_calls[i].function.name == IMAGE_GENERATION_TOOL_NAME:
                     if tool_outputs[i] == "NO_IMAGE_PROVIDED_ERROR":
-                        tool_outputs[i] = "I think you're referring to something you can see. Can you provide a photo?"
+                        tool_outputs[i] = NO_PHOTO_RESPONSE
                         returned_response.image = ""
                     else:
                         returned_response.response = "Here is the image you requested"
                         returned_response.capabilities_used.append(Capability.IMAGE_GENERATION)
-                        returned_response.debug_tools = json.dumps(tools_used)
+                        returned_response.debug_tools = orjson.dumps(tools_used, default=str).decode()
                         returned_response.image = tool_outputs[i]
                         return returned_response
                 
@@ -651,25 +923,17 @@ class GPTAssistant(Assistant):
 
             # Get final response from model
             t0 = timeit.default_timer()
-            second_response = await self._client.chat.completions.create(
+            second_response_message = await self._stream_completion(
                 model=model,
-                messages=message_history
+                messages=message_history,
+                token_usage_by_model=returned_response.token_usage_by_model
             )
             t1 = timeit.default_timer()
             timings["llm_final"] = f"{t1-t0:.3f}"
-
-            # Aggregate tokens and response
-            accumulate_token_usage(
-                token_usage_by_model=returned_response.token_usage_by_model,
-                model=model,
-                input_tokens=second_response.usage.prompt_tokens,
-                output_tokens=second_response.usage.completion_tokens,
-                total_tokens=second_response.usage.total_tokens
-            )
-            returned_response.response = second_response.choices[0].message.content
+            returned_response.response = second_response_message.content
         else:
-            # No tools, cancel speculative tasks
-            self._cancel_tasks([ speculative_vision_task, speculative_search_task ])
+            # No tools, initial response is the answer. Cancel speculative tasks.
+            self._cancel_tasks([ speculative_vision_task, speculative_search_task, direct_llm_task ])
 
         # If no tools were used, only assistant capability recorded
         if len(returned_response.capabilities_used) == 0:
@@ -680,11 +944,198 @@ class GPTAssistant(Assistant):
         timings["total_time"] = f"{t1-tstart:.3f}"
 
         # Return final response
-        returned_response.debug_tools = json.dumps(tools_used)
-        returned_response.timings = json.dumps(timings)
+        returned_response.debug_tools = orjson.dumps(tools_used, default=str).decode()
+        returned_response.timings = orjson.dumps(timings).decode()
         returned_response.image = ""
         return returned_response
     
+    async def _stream_completion(
+        self,
+        model: str,
+        messages: List[Any],
+        token_usage_by_model: Dict[str, TokenUsage],
+        tools: List[Any] | None = None,
+        on_tool_call: Callable[[int, ChatCompletionMessageToolCall], None] | None = None
+    ) -> ChatCompletionMessage:
+        """
+        Performs a streaming chat completion and assembles the streamed chunks into a complete
+        message. Content and tool call arguments arrive as fragments and are concatenated. If no
+        chunk is received for STREAM_IDLE_TIMEOUT_SECONDS, the stream is abandoned and we fall back
+        to a non-streaming completion.
+
+        Parameters
+        ----------
+        model : str
+            Model to use.
+        messages : List[Any]
+            Messages to submit.
+        token_usage_by_model : Dict[str, TokenUsage]
+            Token usage is accumulated here.
+        tools : List[Any] | None
+            Tools the model may call, if any.
+        on_tool_call : Callable[[int, ChatCompletionMessageToolCall], None] | None
+            Invoked with the index of each tool call as soon as its arguments are complete, allowing
+            tools to begin executing while the rest of the completion streams in. Tool calls whose
+            arguments never parse are reported when the stream ends. Not invoked if the stream
+            times out; callers must handle the tool calls in the returned message themselves.
+
+        Returns
+        -------
+        ChatCompletionMessage
+            Complete assistant message, including any tool calls.
+        """
+        kwargs: Dict[str, Any] = { "model": model, "messages": messages }
+        if tools is not None:
+            kwargs["tools"] = tools
+            kwargs["tool_choice"] = "auto"
+
+        # OpenAI must be asked to report usage in the final chunk. Groq always reports it there, in
+        # a separate x_groq field.
+        stream_kwargs: Dict[str, Any] = { "stream": True }
+        if isinstance(self._client, openai.AsyncOpenAI):
+            stream_kwargs["stream_options"] = { "include_usage": True }
+
+        content_fragments: List[str] = []
+        tool_call_fragments: Dict[int, Dict[str, str]] = {}
+        dispatched_indices: Set[int] = set()
+        usage = None
+        fallback_response = None
+        timed_out = False
+        stream = await self._client.chat.completions.create(**kwargs, **stream_kwargs)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=STREAM_IDLE_TIMEOUT_SECONDS)
+                except StopAsyncIteration:
+                    break
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                elif getattr(getattr(chunk, "x_groq", None), "usage", None) is not None:
+                    usage = chunk.x_groq.usage
+                if len(chunk.choices) == 0:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_fragments.append(delta.content)
+                for tool_call_delta in delta.tool_calls or []:
+                    fragment = tool_call_fragments.setdefault(tool_call_delta.index, { "id": "", "name": "", "arguments": "" })
+                    if tool_call_delta.id:
+                        fragment["id"] = tool_call_delta.id
+                    if tool_call_delta.function is not None:
+                        fragment["name"] += tool_call_delta.function.name or ""
+                        fragment["arguments"] += tool_call_delta.function.arguments or ""
+                    if on_tool_call is not None and tool_call_delta.index not in dispatched_indices and self._tool_call_arguments_complete(fragment=fragment):
+                        dispatched_indices.add(tool_call_delta.index)
+                        on_tool_call(tool_call_delta.index, self._make_tool_call(fragment=fragment))
+        except asyncio.TimeoutError:
+            timed_out = True
+        finally:
+            # Always release the connection, including when this task is cancelled mid-stream
+            await stream.close()
+        if timed_out:
+            print(f"Completion stream idle for {STREAM_IDLE_TIMEOUT_SECONDS} seconds, retrying without streaming")
+            fallback_response = await self._client.chat.completions.create(**kwargs)
+            usage = fallback_response.usage
+
+        # Running tally of token usage, updated in place
+        if usage is not None:
+            model_token_usage = token_usage_by_model.get(model)
+            if model_token_usage is None:
+                token_usage_by_model[model] = TokenUsage(input=usage.prompt_tokens, output=usage.completion_tokens, total=usage.total_tokens)
+            else:
+                model_token_usage.input += usage.prompt_tokens
+                model_token_usage.output += usage.completion_tokens
+                model_token_usage.total += usage.total_tokens
+        if fallback_response is not None:
+            return fallback_response.choices[0].message
+
+        tool_calls = [ self._make_tool_call(fragment=fragment) for _, fragment in sorted(tool_call_fragments.items()) ]
+        if on_tool_call is not None:
+            for index, tool_call in enumerate(tool_calls):
+                if index not in dispatched_indices:
+                    on_tool_call(index, tool_call)
+        return ChatCompletionMessage(
+            role="assistant",
+            content="".join(content_fragments) if len(content_fragments) > 0 else None,
+            tool_calls=tool_calls if len(tool_calls) > 0 else None
+        )
+
+    async def _extract_learned_context(self, message_history: List[Message], learned_context: Dict[str, str], previous_task: asyncio.Task | None = None) -> Tuple[Dict[str, str], Dict[str, TokenUsage]]:
+        token_usage_by_model: Dict[str, TokenUsage] = {}
+        if previous_task is not None:
+            # Previous turn's extraction was still in progress when this turn started. Build on its
+            # result so that it is not lost.
+            previously_learned_context = await self._await_learned_context_task(task=previous_task, token_usage_by_model=token_usage_by_model)
+            learned_context = { **previously_learned_context, **learned_context }
+        learned_context = await extract_learned_context(
+            client=self._client,
+            message_history=message_history,
+            existing_learned_context=learned_context.copy(),
+            token_usage_by_model=token_usage_by_model
+        )
+        return learned_context, token_usage_by_model
+
+    async def _consume_learned_context_task(self, session_id: str, token_usage_by_model: Dict[str, TokenUsage]) -> Tuple[Dict[str, str], asyncio.Task | None]:
+        """
+        Retrieves the result of the learned context extraction started by the previous request in
+        this session, if any. Tokens used by the extraction are attributed to the current request.
+        Extraction is never waited on: if it has not finished yet, no context is returned and the
+        unfinished task is returned instead, to be folded into this request's own extraction.
+        """
+        task = _pop_learned_context_task(session_id=session_id)
+        if task is None:
+            return {}, None
+        if not task.done():
+            return {}, task
+        return await self._await_learned_context_task(task=task, token_usage_by_model=token_usage_by_model), None
+
+    @staticmethod
+    async def _await_learned_context_task(task: asyncio.Task, token_usage_by_model: Dict[str, TokenUsage]) -> Dict[str, str]:
+        try:
+            learned_context, extraction_token_usage_by_model = await task
+        except Exception as e:
+            print(f"Learned context extraction failed: {e}")
+            return {}
+        for model, token_usage in extraction_token_usage_by_model.items():
+            if model not in token_usage_by_model:
+                token_usage_by_model[model] = token_usage
+            else:
+                token_usage_by_model[model].add(token_usage=token_usage)
+        return learned_context
+
+    @staticmethod
+    def _canned_response(response: str) -> AssistantResponse:
+        return AssistantResponse(
+            token_usage_by_model={},
+            capabilities_used=[ Capability.ASSISTANT_KNOWLEDGE ],
+            response=response,
+            debug_tools="[]",
+            timings=orjson.dumps({ "total_time": "0.000" }).decode(),
+            image=""
+        )
+
+    @staticmethod
+    def _tool_call_arguments_complete(fragment: Dict[str, str]) -> bool:
+        if len(fragment["id"]) == 0 or len(fragment["name"]) == 0:
+            return False
+        try:
+            orjson.loads(fragment["arguments"])
+            return True
+        except orjson.JSONDecodeError:
+            return False
+
+    @staticmethod
+    def _make_tool_call(fragment: Dict[str, str]) -> ChatCompletionMessageToolCall:
+        return ChatCompletionMessageToolCall(
+            id=fragment["id"],
+            type="function",
+            function=Function(name=fragment["name"], arguments=fragment["arguments"])
+        )
+
+    @staticmethod
+    async def _get_batch_result(batch_task: asyncio.Task, position: int) -> Any:
+        return (await batch_task)[position]
+
     @staticmethod
     def _cancel_tasks(tasks: list):
         for task in tasks:
@@ -708,27 +1159,20 @@ class GPTAssistant(Assistant):
         List[Message]
             Pruned history. This is the same list passed as input.
         """
-        # Limit to most recent 5 user messages and 3 assistant responses
-        assistant_messages_remaining = 3
-        user_messages_remaining = 5
-        message_history.reverse()
-        i = 0
-        while i < len(message_history):
-            if message_history[i].role == Role.ASSISTANT:
-                if assistant_messages_remaining == 0:
-                    del message_history[i]
-                else:
-                    assistant_messages_remaining -= 1
-                    i += 1
-            elif message_history[i].role == Role.USER:
-                if user_messages_remaining == 0:
-                    del message_history[i]
-                else:
-                    user_messages_remaining -= 1
-                    i += 1
+        # Limit to most recent 5 user messages and 3 assistant responses. Fixed-length deques drop
+        # older messages as newer ones arrive, then the survivors are merged back in their original
+        # order.
+        user_messages: Deque[Tuple[int, Message]] = deque(maxlen=5)
+        assistant_messages: Deque[Tuple[int, Message]] = deque(maxlen=3)
+        other_messages: List[Tuple[int, Message]] = []
+        for i, message in enumerate(message_history):
+            if message.role == Role.USER:
+                user_messages.append((i, message))
+            elif message.role == Role.ASSISTANT:
+                assistant_messages.append((i, message))
             else:
-                i += 1
-        message_history.reverse()
+                other_messages.append((i, message))
+        message_history[:] = [ message for _, message in heapq.merge(other_messages, user_messages, assistant_messages, key=itemgetter(0)) ]
         return message_history
 
 Assistant.register(GPTAssistant)
\ No newline at end of file
@@ -7,7 +7,7 @@
 from enum import Enum
 from typing import Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 from .token_usage import TokenUsage
 
@@ -18,6 +18,9 @@ class Role(str, Enum):
     USER = "user"
 
 class Message(BaseModel):
+    # Immutable so that module-level instances can be shared across requests
+    model_config = ConfigDict(frozen=True)
+
     role: Role
     content: str
 
@@ -77,6 +80,7 @@ class MultimodalRequest(BaseModel):
     generate_image: Optional[int] = 0
     generate_image_service: Optional[GenerateImageService] = GenerateImageService.REPLICATE
     testing_mode: Optional[bool] = False
+    session_id: Optional[str] = None
 
 class MultimodalResponse(BaseModel):
     user_prompt: str
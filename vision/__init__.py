@@ -1,3 +1,3 @@
-from .vision import Vision
+from .vision import Vision, VisionOutput
 from .gpt4vision import GPT4Vision
 from .claude_vision import ClaudeVision
\ No newline at end of file
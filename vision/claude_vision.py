@@ -77,7 +77,7 @@ class ClaudeVision(Vision):
 
         response = await self._client.messages.create(
             model=self._model,
-            system=SYSTEM_MESSAGE + extra_context,
+            system=SYSTEM_MESSAGE + "\n\n" + extra_context,
             messages=messages,
             max_tokens=4096,
             temperature=0.0,
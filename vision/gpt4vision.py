@@ -5,7 +5,8 @@
 #
 
 import base64
-from typing import Dict, Optional
+from functools import lru_cache
+from typing import Dict, List, Optional
 
 import openai
 from pydantic import BaseModel
@@ -15,7 +16,7 @@ from .utils import detect_media_type
 from models import TokenUsage, accumulate_token_usage
 
 
-SYSTEM_MESSAGE = """
+SYSTEM_MESSAGE_PREAMBLE = """
 You are Noa, a smart personal AI assistant inside the user's AR smart glasses that answers all user
 queries and questions. You have access to a photo from the smart glasses camera of what the user was
 seeing at the time they spoke but you NEVER mention the photo or image and instead respond as if you
@@ -23,19 +24,32 @@ are actually seeing.
 
 The camera is unfortunately VERY low quality but the user is counting on you to interpret the
 blurry, pixelated images. NEVER comment on image quality. Do your best with images.
+"""
 
-ALWAYS respond with a JSON object with these fields:
-
+OUTPUT_FIELDS_DESCRIPTION = """
 response: (String) Respond to user as best you can. Be precise, get to the point, and speak as though you actually see the image.
 web_query: (String) Empty if your "response" answers everything user asked. If web search based on visual description would be more helpful, create a query (e.g. up-to-date, location-based, or product info).
 reverse_image_search: (Bool) True if your web query from description is insufficient and including the *exact* thing user is looking at as visual target is needed.
 """
 
+SYSTEM_MESSAGE = SYSTEM_MESSAGE_PREAMBLE + """
+ALWAYS respond with a JSON object with these fields:
+""" + OUTPUT_FIELDS_DESCRIPTION
+
+BATCH_SYSTEM_MESSAGE = SYSTEM_MESSAGE_PREAMBLE + """
+The user will ask several numbered queries about the same photo. ALWAYS respond with a JSON object
+with a single field, "results", which is an array containing one object per query, in the same
+order as the queries. Each object has these fields:
+""" + OUTPUT_FIELDS_DESCRIPTION
+
 class ModelOutput(BaseModel):
     response: str
     web_query: Optional[str] = None
     reverse_image_search: Optional[bool] = None
 
+class BatchModelOutput(BaseModel):
+    results: List[ModelOutput]
+
 
 class GPT4Vision(Vision):
     def __init__(self, client: openai.AsyncOpenAI, model: str = "gpt-4o"):
@@ -47,12 +61,45 @@ class GPT4Vision(Vision):
         return self._model
     
     async def query_image(self, query: str, extra_context: str, image_bytes: bytes | None, token_usage_by_model: Dict[str, TokenUsage]) -> VisionOutput | None:
+        content = await self._query(
+            system_message=self._system_message_for(batch=False, extra_context=extra_context),
+            text=query,
+            image_bytes=image_bytes,
+            token_usage_by_model=token_usage_by_model
+        )
+        
+        # Convert to VisionResponse and return
+        output = self._parse_response(content=content)
+        if output is None:
+            return None
+        return self._to_vision_output(output=output, query=query)
+
+    async def query_image_batch(self, queries: List[str], extra_context: str, image_bytes: bytes | None, token_usage_by_model: Dict[str, TokenUsage]) -> List[VisionOutput | None]:
+        if len(queries) <= 1:
+            return await super().query_image_batch(queries=queries, extra_context=extra_context, image_bytes=image_bytes, token_usage_by_model=token_usage_by_model)
+
+        # All queries go in a single request so the image is only uploaded once
+        content = await self._query(
+            system_message=self._system_message_for(batch=True, extra_context=extra_context),
+            text="\n".join([ f"{i + 1}. {query}" for i, query in enumerate(queries) ]),
+            image_bytes=image_bytes,
+            token_usage_by_model=token_usage_by_model,
+            json_mode=True
+        )
+
+        # If the model did not answer every query, fall back to querying individually
+        batch_output = self._parse_batch_response(content=content)
+        if batch_output is None or len(batch_output.results) != len(queries):
+            return await super().query_image_batch(queries=queries, extra_context=extra_context, image_bytes=image_bytes, token_usage_by_model=token_usage_by_model)
+        return [ self._to_vision_output(output=output, query=query) for output, query in zip(batch_output.results, queries) ]
+
+    async def _query(self, system_message: str, text: str, image_bytes: bytes | None, token_usage_by_model: Dict[str, TokenUsage], json_mode: bool = False) -> str:
         messages = [
-            { "role": "system", "content": SYSTEM_MESSAGE + extra_context },
+            { "role": "system", "content": system_message },
             {
                 "role": "user",
                 "content": [
-                    { "type": "text", "text": query }
+                    { "type": "text", "text": text }
                 ]
             }
         ]
@@ -60,12 +107,13 @@ class GPT4Vision(Vision):
         if image_bytes:
             image_base64 = base64.b64encode(image_bytes).decode("utf-8")
             media_type = detect_media_type(image_bytes=image_bytes)
-            messages[1]["content"].append({ "type": "image_url", "image_url": { "url": f"data:{media_type};base64,{image_base64}" } }),
+            messages[1]["content"].append({ "type": "image_url", "image_url": { "url": f"data:{media_type};base64,{image_base64}" } })
         
         response = await self._client.chat.completions.create(
             model=self._model,
             messages=messages,
-            max_tokens=4096
+            max_tokens=4096,
+            response_format={ "type": "json_object" } if json_mode else openai.NOT_GIVEN
         )
 
         accumulate_token_usage(
@@ -75,11 +123,17 @@ class GPT4Vision(Vision):
             output_tokens=response.usage.completion_tokens,
             total_tokens=response.usage.total_tokens
         )
-        
-        # Convert to VisionResponse and return
-        output = self._parse_response(content=response.choices[0].message.content)
-        if output is None:
-            return None
+        return response.choices[0].message.content
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _system_message_for(batch: bool, extra_context: str) -> str:
+        # Extra context rarely changes between consecutive queries and is usually the very same
+        # (cached) string object, making lookups cheap, so reuse the assembled prompt
+        return (BATCH_SYSTEM_MESSAGE if batch else SYSTEM_MESSAGE) + "\n\n" + extra_context
+
+    @staticmethod
+    def _to_vision_output(output: ModelOutput, query: str) -> VisionOutput:
         web_query = output.web_query if output.web_query is not None else ""
         reverse_image_search = output.reverse_image_search is not None and output.reverse_image_search == True
         if len(web_query) == 0 and reverse_image_search:
@@ -100,5 +154,17 @@ class GPT4Vision(Vision):
         except:
             pass
         return None
+
+    @staticmethod
+    def _parse_batch_response(content: str) -> BatchModelOutput | None:
+        # Response expected to be JSON but may be wrapped with ```json ... ```
+        json_start = content.find("{")
+        json_end = content.rfind("}")
+        json_string = content[json_start : json_end + 1]
+        try:
+            return BatchModelOutput.model_validate_json(json_data=json_string)
+        except:
+            pass
+        return None
     
 Vision.register(GPT4Vision)
\ No newline at end of file
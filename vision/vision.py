@@ -5,8 +5,9 @@
 #
 
 from abc import ABC, abstractmethod
+import asyncio
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, List
 
 from models import TokenUsage
 
@@ -21,6 +22,16 @@ class VisionOutput:
         return len(self.web_query) > 0
 
 class Vision(ABC):
+    # extra_context is additional system prompt context (see assistant.context), which
+    # implementations append to their own system prompt
     @abstractmethod
     async def query_image(self, query: str, extra_context: str, image_bytes: bytes | None, token_usage_by_model: Dict[str, TokenUsage]) -> VisionOutput | None:
-        pass
\ No newline at end of file
+        pass
+
+    async def query_image_batch(self, queries: List[str], extra_context: str, image_bytes: bytes | None, token_usage_by_model: Dict[str, TokenUsage]) -> List[VisionOutput | None]:
+        """
+        Answers multiple queries about the same image. By default, each query is submitted
+        separately and in parallel. Implementations that can answer several queries in a single
+        request, uploading the image only once, should override this.
+        """
+        return await asyncio.gather(*[ self.query_image(query=query, extra_context=extra_context, image_bytes=image_bytes, token_usage_by_model=token_usage_by_model) for query in queries ])
\ No newline at end of file